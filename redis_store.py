@@ -0,0 +1,155 @@
+"""
+redis_store.py
+Redis-backed game store, used instead of the in-memory games dict when REDIS_URL is set
+so that several server processes can share rooms.
+
+Each game is a hash game:{room} with fields board, turn, status, winner, x_bits, o_bits
+and one p:{sid} = "X"/"O" field per player. Every state change runs as a Lua script, so
+Redis applies the check and the update atomically and no worker can act on a stale turn.
+Scripts return {code, board, turn, status, winner}; non-zero codes match server.ERR_*.
+
+Seats are only cleared by the worker the player is connected to, so every write refreshes
+a TTL on the hash; rooms left behind by a crashed worker expire instead of staying full.
+"""
+
+import redis.asyncio as redis
+
+EMPTY_BOARD = "........."
+# Seconds a room may go without any write before Redis drops it
+GAME_TTL = 3600
+
+# Shared by the scripts: players(key) lists the p:{sid} fields in insertion order
+_LUA_PRELUDE = """
+local function players(key)
+    local fields, out = redis.call("HKEYS", key), {}
+    for _, f in ipairs(fields) do
+        if string.sub(f, 1, 2) == "p:" then out[#out + 1] = f end
+    end
+    return out
+end
+local function touch(key, ttl)
+    redis.call("EXPIRE", key, ttl)
+end
+local function state(key)
+    local g = redis.call("HMGET", key, "board", "turn", "status", "winner")
+    return {0, g[1], g[2], g[3], g[4]}
+end
+"""
+
+_CREATE = _LUA_PRELUDE + """
+if redis.call("EXISTS", KEYS[1]) == 1 then return {1} end
+redis.call("HSET", KEYS[1], "board", ARGV[2], "turn", "X", "status", "waiting", "winner", "",
+           "x_bits", 0, "o_bits", 0, "p:" .. ARGV[1], "X")
+touch(KEYS[1], ARGV[3])
+return state(KEYS[1])
+"""
+
+_JOIN = _LUA_PRELUDE + """
+if redis.call("EXISTS", KEYS[1]) == 0 then return {1} end
+if #players(KEYS[1]) >= 2 then return {2} end
+redis.call("HSET", KEYS[1], "p:" .. ARGV[1], "O", "status", "playing")
+touch(KEYS[1], ARGV[2])
+return state(KEYS[1])
+"""
+
+_MOVE = _LUA_PRELUDE + """
+local WIN_MASKS = {7, 56, 448, 73, 146, 292, 273, 84}
+if redis.call("EXISTS", KEYS[1]) == 0 then return {1} end
+local g = redis.call("HMGET", KEYS[1], "status", "turn", "x_bits", "o_bits", "board", "p:" .. ARGV[1])
+if g[1] ~= "playing" then return {3} end
+local symbol = g[6]
+if not symbol then return {4} end
+if g[2] ~= symbol then return {5} end
+local idx = tonumber(ARGV[2])
+local x, o = tonumber(g[3]), tonumber(g[4])
+local cell = bit.lshift(1, idx)
+if bit.band(bit.bor(x, o), cell) ~= 0 then return {6} end
+
+local bits
+if symbol == "X" then x = bit.bor(x, cell); bits = x else o = bit.bor(o, cell); bits = o end
+local board = string.sub(g[5], 1, idx) .. symbol .. string.sub(g[5], idx + 2)
+local turn, status, winner = g[2], "playing", ""
+for _, m in ipairs(WIN_MASKS) do
+    if bit.band(m, cell) ~= 0 and bit.band(bits, m) == m then
+        status, winner = "done", symbol
+        break
+    end
+end
+if status ~= "done" then
+    if bit.bor(x, o) == 511 then
+        status, winner = "done", "draw"
+    else
+        turn = (symbol == "X") and "O" or "X"
+    end
+end
+redis.call("HSET", KEYS[1], "board", board, "turn", turn, "status", status, "winner", winner,
+           "x_bits", x, "o_bits", o)
+touch(KEYS[1], ARGV[3])
+return {0, board, turn, status, winner}
+"""
+
+_RESTART = _LUA_PRELUDE + """
+if redis.call("EXISTS", KEYS[1]) == 0 then return {1} end
+local ps = players(KEYS[1])
+redis.call("HSET", KEYS[1], "board", ARGV[1], "turn", "X", "status", "waiting", "winner", "",
+           "x_bits", 0, "o_bits", 0, ps[1], "X")
+if #ps > 1 then
+    redis.call("HSET", KEYS[1], ps[2], "O", "status", "playing")
+end
+touch(KEYS[1], ARGV[2])
+return state(KEYS[1])
+"""
+
+_LEAVE = _LUA_PRELUDE + """
+if redis.call("HDEL", KEYS[1], "p:" .. ARGV[1]) == 0 then return {1} end
+if #players(KEYS[1]) == 0 then
+    redis.call("DEL", KEYS[1])
+    return {1}
+end
+redis.call("HSET", KEYS[1], "status", "waiting")
+touch(KEYS[1], ARGV[2])
+return state(KEYS[1])
+"""
+
+
+def _to_state(res):
+    _, board, turn, status, winner = res
+    return {"board": ["" if c == "." else c for c in board], "turn": turn, "status": status,
+            "winner": winner or None}
+
+
+class RedisGameStore:
+    def __init__(self, url, ttl=GAME_TTL):
+        self._ttl = ttl
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        # register_script runs EVALSHA and falls back to EVAL if Redis has not cached the script
+        self._create = self._redis.register_script(_CREATE)
+        self._join = self._redis.register_script(_JOIN)
+        self._move = self._redis.register_script(_MOVE)
+        self._restart = self._redis.register_script(_RESTART)
+        self._leave = self._redis.register_script(_LEAVE)
+
+    async def create(self, room_id, sid):
+        """Create room_id with sid as X; returns the state, or None if the id is taken."""
+        res = await self._create(keys=[f"game:{room_id}"], args=[sid, EMPTY_BOARD, self._ttl])
+        return _to_state(res) if res[0] == 0 else None
+
+    async def join(self, room_id, sid):
+        """Seat sid as O; returns (error code, state)."""
+        res = await self._join(keys=[f"game:{room_id}"], args=[sid, self._ttl])
+        return res[0], (_to_state(res) if res[0] == 0 else None)
+
+    async def move(self, room_id, sid, idx):
+        """Play idx for sid; returns (error code, state). idx must already be an int in 0..8."""
+        res = await self._move(keys=[f"game:{room_id}"], args=[sid, idx, self._ttl])
+        return res[0], (_to_state(res) if res[0] == 0 else None)
+
+    async def restart(self, room_id):
+        """Reset the board keeping the seated players; returns the state, or None if the room is gone."""
+        res = await self._restart(keys=[f"game:{room_id}"], args=[EMPTY_BOARD, self._ttl])
+        return _to_state(res) if res[0] == 0 else None
+
+    async def leave(self, room_id, sid):
+        """Unseat sid; returns the state, or None if the room is gone or now empty (and deleted)."""
+        res = await self._leave(keys=[f"game:{room_id}"], args=[sid, self._ttl])
+        return _to_state(res) if res[0] == 0 else None
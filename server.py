@@ -1,132 +1,345 @@
 """
 server.py
-Flask + Flask-SocketIO backend for Tic-Tac-Toe multiplayer rooms.
+python-socketio (ASGI) + Starlette backend for Tic-Tac-Toe multiplayer rooms.
+
+Run with: uvicorn server:asgi_app --loop uvloop --http httptools
+In production run with SERVE_STATIC=0 behind nginx (deploy/nginx.conf), which serves static/ itself.
+Set REDIS_URL to run several workers: Redis then carries broadcasts and holds the games (redis_store.py).
+Workers need sticky sessions: the client starts on long-polling, and every request of a session
+must reach the worker that did the handshake. Run one uvicorn per port behind the ip_hash upstream
+in deploy/nginx.conf rather than `uvicorn --workers N`, which shares one port without stickiness.
 """
 
-from flask import Flask, send_from_directory, request
-from flask_socketio import SocketIO, join_room, leave_room, emit
-import uuid
+from dataclasses import dataclass, field
+import os
+import socketio
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.staticfiles import StaticFiles
+import secrets
 
-app = Flask(__name__, static_folder="static", static_url_path="/")
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode="gevent")
+REDIS_URL = os.environ.get("REDIS_URL")
+# With a message queue any worker can deliver a broadcast to clients connected to another
+client_manager = socketio.AsyncRedisManager(REDIS_URL) if REDIS_URL else None
+sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*", serializer="msgpack",
+                           client_manager=client_manager)
+# Local/dev convenience only; the reverse proxy should keep asset requests off the event loop
+SERVE_STATIC = os.environ.get("SERVE_STATIC", "1") != "0"
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+if SERVE_STATIC:
+    app = Starlette(routes=[Mount("/", app=StaticFiles(directory=STATIC_DIR, html=True), name="static")])
+    asgi_app = socketio.ASGIApp(sio, other_asgi_app=app)
+else:
+    asgi_app = socketio.ASGIApp(sio)
 
 # In-memory store of games
 games = {}
 
-@app.route("/")
-def index():
-    return send_from_directory(app.static_folder, "index.html")
-
-@app.route("/<path:path>")
-def static_proxy(path):
-    return send_from_directory(app.static_folder, path)
-
-def new_game_state():
-    return {"board": [""] * 9, "turn": "X", "players": {}, "status": "waiting", "winner": None}
-
-@socketio.on("create_game")
-def on_create_game(data):
-    room_id = str(uuid.uuid4())[:8]
-    games[room_id] = new_game_state()
-    sid = request.sid
-    games[room_id]["players"][sid] = "X"
-    join_room(room_id)
-    games[room_id]["status"] = "waiting"
-    emit("game_created", {"room": room_id, "symbol": "X", "state": games[room_id]}, room=sid)
-
-@socketio.on("join_game")
-def on_join_game(data):
-    room_id = data.get("room")
-    sid = request.sid
-    if room_id not in games:
-        emit("error", {"message": "Room not found."}, room=sid)
-        return
-    game = games[room_id]
-    if len(game["players"]) >= 2:
-        emit("error", {"message": "Room full."}, room=sid)
-        return
-    game["players"][sid] = "O"
-    join_room(room_id)
-    game["status"] = "playing"
-    emit("player_joined", {"room": room_id, "symbol": "O", "state": game}, room=room_id)
-
-@socketio.on("make_move")
-def on_make_move(data):
-    room_id = data.get("room")
-    idx = data.get("index")
-    sid = request.sid
-    if room_id not in games:
-        emit("error", {"message": "Room not found."}, room=sid)
-        return
+# Room each connected player is seated in, so disconnects don't scan every game
+sid_to_room = {}
 
-    game = games[room_id]
-    if game["status"] != "playing":
-        emit("error", {"message": "Game not active."}, room=sid)
-        return
+# Latest state per room waiting to be broadcast; coalesced by flush_pending_emits
+pending_emit = {}
+EMIT_FLUSH_DELAY = 0.003
+_flush_scheduled = False
+
+# Bit i is set when cell i is taken; a line is won when all three of its bits are set
+WIN_MASKS = (
+    0b000000111, 0b000111000, 0b111000000,  # rows
+    0b001001001, 0b010010010, 0b100100100,  # columns
+    0b100010001, 0b001010100,               # diagonals
+)
+FULL_BOARD = 0b111111111
+EMPTY_BOARD = bytes(9)
+# Client-facing string for each board byte
+CELL_STRS = {0: "", ord("X"): "X", ord("O"): "O"}
+# Only the lines through the cell just played can be newly completed
+CELL_LINES = tuple(tuple(m for m in WIN_MASKS if m & (1 << i)) for i in range(9))
+
+@dataclass(slots=True)
+class Game:
+    # "board" is only kept as the client-facing view; the bitboards are authoritative.
+    # One byte per cell: 0 for empty, otherwise ord("X") / ord("O")
+    board: bytearray = field(default_factory=lambda: bytearray(9))
+    turn: str = "X"
+    players: dict = field(default_factory=dict)
+    status: str = "waiting"
+    winner: str | None = None
+    x_bits: int = 0
+    o_bits: int = 0
+
+    def reset(self):
+        self.board[:] = EMPTY_BOARD
+        self.turn = "X"
+        self.players.clear()
+        self.status = "waiting"
+        self.winner = None
+        self.x_bits = self.o_bits = 0
+
+# Finished games are reset and reused instead of being reallocated
+_game_pool = []
+GAME_POOL_MAX = 1024
+
+def acquire_game():
+    return _game_pool.pop() if _game_pool else Game()
 
-    symbol = game["players"].get(sid)
+def release_game(game):
+    if len(_game_pool) < GAME_POOL_MAX:
+        game.reset()
+        _game_pool.append(game)
+
+def schedule_state_emit(room_id, game):
+    global _flush_scheduled
+    pending_emit[room_id] = game
+    if not _flush_scheduled:
+        _flush_scheduled = True
+        sio.start_background_task(flush_pending_emits)
+
+async def flush_pending_emits():
+    global _flush_scheduled
+    await sio.sleep(EMIT_FLUSH_DELAY)
+    batch = list(pending_emit.items())
+    pending_emit.clear()
+    _flush_scheduled = False
+    for room_id, game in batch:
+        # Each emit yields, so a room may have emptied (and its Game been pooled or reused by
+        # another room) since it was queued. Never emit with an empty `to`: python-socketio
+        # treats that as a broadcast to every client.
+        if games.get(room_id) is not game or not game.players:
+            continue
+        # Address the (at most two) seated players directly instead of resolving the room;
+        # one emit still encodes the packet once for both of them
+        await sio.emit("update_state", {"state": public_state(game)}, to=list(game.players))
+
+# Validation error codes and their payloads, built once instead of per error emit
+ERR_ROOM_NOT_FOUND, ERR_ROOM_FULL, ERR_NOT_ACTIVE, ERR_NOT_PLAYER, ERR_NOT_YOUR_TURN, ERR_INVALID_MOVE = range(1, 7)
+ERR_PAYLOADS = {
+    ERR_ROOM_NOT_FOUND: {"message": "Room not found."},
+    ERR_ROOM_FULL: {"message": "Room full."},
+    ERR_NOT_ACTIVE: {"message": "Game not active."},
+    ERR_NOT_PLAYER: {"message": "You are not part of this game."},
+    ERR_NOT_YOUR_TURN: {"message": "Not your turn."},
+    ERR_INVALID_MOVE: {"message": "Invalid move."},
+}
+
+def validate_move(game, sid, idx, taken):
+    """Return 0 if sid may play idx in game, else an ERR_* code. taken is x_bits | o_bits."""
+    if game.status != "playing":
+        return ERR_NOT_ACTIVE
+    symbol = game.players.get(sid)
     if symbol is None:
-        emit("error", {"message": "You are not part of this game."}, room=sid)
-        return
+        return ERR_NOT_PLAYER
+    if game.turn != symbol:
+        return ERR_NOT_YOUR_TURN
+    if type(idx) is not int or not (0 <= idx < 9) or (taken >> idx) & 1:
+        return ERR_INVALID_MOVE
+    return 0
 
-    if game["turn"] != symbol:
-        emit("error", {"message": "Not your turn."}, room=sid)
-        return
+def public_state(game):
+    # What clients need to render; players (keyed by SID) and the bitboards stay server-side
+    return {"board": [CELL_STRS[c] for c in game.board], "turn": game.turn, "status": game.status, "winner": game.winner}
 
-    if not (0 <= idx < 9) or game["board"][idx] != "":
-        emit("error", {"message": "Invalid move."}, room=sid)
-        return
+def new_room_id():
+    # Room ids double as join codes, so keep them unguessable
+    room_id = secrets.token_urlsafe(6)
+    while room_id in games:
+        room_id = secrets.token_urlsafe(6)
+    return room_id
 
-    game["board"][idx] = symbol
-    winner = check_winner(game["board"])
-    if winner:
-        game["status"] = "done"
-        game["winner"] = winner
-    elif all(cell != "" for cell in game["board"]):
-        game["status"] = "done"
-        game["winner"] = "draw"
+async def leave_current_room(sid):
+    room_id = sid_to_room.pop(sid, None)
+    game = games.get(room_id)
+    if game is None:
+        return
+    game.players.pop(sid, None)
+    await sio.leave_room(sid, room_id)
+    if len(game.players) == 0:
+        # Nobody is left in the room to receive its last update
+        pending_emit.pop(room_id, None)
+        release_game(games.pop(room_id))
     else:
-        game["turn"] = "O" if game["turn"] == "X" else "X"
-    emit("update_state", {"state": game}, room=room_id)
+        game.status = "waiting"
+        schedule_state_emit(room_id, game)
 
-@socketio.on("restart_game")
-def on_restart(data):
-    room_id = data.get("room")
-    if room_id not in games:
-        return
-    game = games[room_id]
-    sids = list(game["players"].keys())
-    new_state = new_game_state()
-    new_state["players"] = {sids[0]: "X"}
-    if len(sids) > 1:
-        new_state["players"][sids[1]] = "O"
-        new_state["status"] = "playing"
-    games[room_id] = new_state
-    emit("update_state", {"state": new_state}, room=room_id)
-
-@socketio.on("disconnect")
-def on_disconnect():
-    sid = request.sid
-    to_delete = []
-    for room_id, game in list(games.items()):
-        if sid in game["players"]:
-            del game["players"][sid]
-            emit("update_state", {"state": game}, room=room_id)
-            if len(game["players"]) == 0:
-                to_delete.append(room_id)
-            else:
-                game["status"] = "waiting"
-    for r in to_delete:
-        del games[r]
-
-def check_winner(b):
-    wins = [(0,1,2),(3,4,5),(6,7,8),(0,3,6),(1,4,7),(2,5,8),(0,4,8),(2,4,6)]
-    for a,bidx,c in wins:
-        if b[a] and b[a] == b[bidx] == b[c]:
-            return b[a]
-    return None
+class GameNamespace(socketio.AsyncNamespace):
+    def __init__(self, namespace="/"):
+        super().__init__(namespace)
+        # Bound once here so handlers resolve them as attributes rather than module globals
+        self._games = games
+        self._sid_to_room = sid_to_room
+        self._emit = sio.emit
+        self._enter_room = sio.enter_room
+        self._schedule_state_emit = schedule_state_emit
+        self._leave_current_room = leave_current_room
+
+    async def on_create_game(self, sid, data):
+        await self._leave_current_room(sid)
+        room_id = new_room_id()
+        game = self._games[room_id] = acquire_game()
+        game.players[sid] = "X"
+        self._sid_to_room[sid] = room_id
+        await self._enter_room(sid, room_id)
+        game.status = "waiting"
+        await self._emit("game_created", {"room": room_id, "symbol": "X", "state": public_state(game)}, room=sid)
+
+    async def on_join_game(self, sid, data):
+        room_id = data.get("room")
+        game = self._games.get(room_id)
+        if game is None:
+            await self._emit("error", ERR_PAYLOADS[ERR_ROOM_NOT_FOUND], room=sid)
+            return
+        if len(game.players) >= 2:
+            await self._emit("error", ERR_PAYLOADS[ERR_ROOM_FULL], room=sid)
+            return
+        if self._sid_to_room.get(sid) != room_id:
+            await self._leave_current_room(sid)
+        game.players[sid] = "O"
+        self._sid_to_room[sid] = room_id
+        await self._enter_room(sid, room_id)
+        game.status = "playing"
+        # Each client learns its own symbol once; the host already got "X" in game_created
+        state = public_state(game)
+        await self._emit("player_joined", {"room": room_id, "symbol": "O", "state": state}, room=sid)
+        await self._emit("player_joined", {"room": room_id, "state": state}, room=room_id, skip_sid=sid)
+
+    async def on_make_move(self, sid, data):
+        room_id = data.get("room")
+        idx = data.get("index")
+        game = self._games.get(room_id)
+        if game is None:
+            await self._emit("error", ERR_PAYLOADS[ERR_ROOM_NOT_FOUND], room=sid)
+            return
+        # Occupied cells, shared by the cell-free check and the draw check
+        taken = game.x_bits | game.o_bits
+        code = validate_move(game, sid, idx, taken)
+        if code:
+            await self._emit("error", ERR_PAYLOADS[code], room=sid)
+            return
+
+        symbol = game.turn
+        game.board[idx] = ord(symbol)
+        if symbol == "X":
+            game.x_bits |= 1 << idx
+            bits = game.x_bits
+        else:
+            game.o_bits |= 1 << idx
+            bits = game.o_bits
+        if check_winner_at(bits, idx):
+            game.status = "done"
+            game.winner = symbol
+        elif taken | (1 << idx) == FULL_BOARD:
+            game.status = "done"
+            game.winner = "draw"
+        else:
+            game.turn = "O" if game.turn == "X" else "X"
+        self._schedule_state_emit(room_id, game)
+
+    async def on_restart_game(self, sid, data):
+        room_id = data.get("room")
+        game = self._games.get(room_id)
+        if game is None:
+            return
+        sids = list(game.players.keys())
+        game.reset()
+        game.players[sids[0]] = "X"
+        if len(sids) > 1:
+            game.players[sids[1]] = "O"
+            game.status = "playing"
+        self._schedule_state_emit(room_id, game)
+
+    async def on_leave_game(self, sid, data):
+        await self._leave_current_room(sid)
+
+    async def on_disconnect(self, sid, *args):
+        await self._leave_current_room(sid)
+
+class RedisGameNamespace(socketio.AsyncNamespace):
+    """Same events as GameNamespace, with games kept in Redis so any worker can serve a room."""
+
+    def __init__(self, store, namespace="/"):
+        super().__init__(namespace)
+        self._store = store
+        # A client's events and its disconnect are always handled by the worker it is connected to
+        self._sid_to_room = {}
+        self._emit = sio.emit
+        self._enter_room = sio.enter_room
+
+    async def _leave_current_room(self, sid):
+        room_id = self._sid_to_room.pop(sid, None)
+        if room_id is None:
+            return
+        await sio.leave_room(sid, room_id)
+        state = await self._store.leave(room_id, sid)
+        if state is not None:
+            await self._emit("update_state", {"state": state}, room=room_id)
+
+    async def on_create_game(self, sid, data):
+        await self._leave_current_room(sid)
+        state = None
+        while state is None:
+            room_id = secrets.token_urlsafe(6)
+            state = await self._store.create(room_id, sid)
+        self._sid_to_room[sid] = room_id
+        await self._enter_room(sid, room_id)
+        await self._emit("game_created", {"room": room_id, "symbol": "X", "state": state}, room=sid)
+
+    async def on_join_game(self, sid, data):
+        room_id = data.get("room")
+        if not isinstance(room_id, str):
+            await self._emit("error", ERR_PAYLOADS[ERR_ROOM_NOT_FOUND], room=sid)
+            return
+        code, state = await self._store.join(room_id, sid)
+        if code:
+            await self._emit("error", ERR_PAYLOADS[code], room=sid)
+            return
+        if self._sid_to_room.get(sid) != room_id:
+            await self._leave_current_room(sid)
+        self._sid_to_room[sid] = room_id
+        await self._enter_room(sid, room_id)
+        await self._emit("player_joined", {"room": room_id, "symbol": "O", "state": state}, room=sid)
+        await self._emit("player_joined", {"room": room_id, "state": state}, room=room_id, skip_sid=sid)
+
+    async def on_make_move(self, sid, data):
+        room_id = data.get("room")
+        idx = data.get("index")
+        if not isinstance(room_id, str):
+            code = ERR_ROOM_NOT_FOUND
+        elif type(idx) is not int or not (0 <= idx < 9):
+            code = ERR_INVALID_MOVE
+        else:
+            code, state = await self._store.move(room_id, sid, idx)
+        if code:
+            await self._emit("error", ERR_PAYLOADS[code], room=sid)
+            return
+        await self._emit("update_state", {"state": state}, room=room_id)
+
+    async def on_restart_game(self, sid, data):
+        room_id = data.get("room")
+        if not isinstance(room_id, str):
+            return
+        state = await self._store.restart(room_id)
+        if state is not None:
+            await self._emit("update_state", {"state": state}, room=room_id)
+
+    async def on_leave_game(self, sid, data):
+        await self._leave_current_room(sid)
+
+    async def on_disconnect(self, sid, *args):
+        await self._leave_current_room(sid)
+
+if REDIS_URL:
+    from redis_store import RedisGameStore
+    sio.register_namespace(RedisGameNamespace(RedisGameStore(REDIS_URL)))
+else:
+    sio.register_namespace(GameNamespace("/"))
+
+def check_winner_at(bits, idx):
+    for m in CELL_LINES[idx]:
+        if bits & m == m:
+            return True
+    return False
 
 if __name__ == "__main__":
-    import os
+    import uvicorn
     port = int(os.environ.get("PORT", 5000))
-    socketio.run(app, host="0.0.0.0", port=port)
+    uvicorn.run("server:asgi_app", host="0.0.0.0", port=port, loop="uvloop", http="httptools")
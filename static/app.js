@@ -231,11 +231,8 @@ socket.on("player_joined", (data) => {
   // If we were host, we already had symbol X. If we joined, server sends symbol
   // server included symbol in initial create/join responses; but here both get updated state
   setStatus(`Player joined. Game starts. Turn: ${data.state.turn}`);
-  // determine our symbol
-  // server keeps mapping sid->symbol but client doesn't get sid map. Server sends state only.
-  // server earlier sent symbol on create; joiner will receive 'game_created'? No — join emits player_joined to room.
-  // we will set mySymbol if not set (joiner must have been assigned by earlier event)
-  // to be robust, server sends symbol in earlier events; client should keep previously set mySymbol.
+  // only the joining client is sent a symbol; the host keeps the one from game_created
+  if (data.symbol) setMySymbol(data.symbol);
   state = data.state;
   renderBoard(state.board);
 });